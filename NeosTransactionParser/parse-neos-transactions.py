@@ -1,8 +1,10 @@
+import argparse
+from contextlib import ExitStack
 import csv
 from datetime import datetime
+import gzip
 import os
 from posixpath import split
-import sys
 
 # Koinly import formats: https://help.koinly.io/en/articles/3662999-how-to-create-a-custom-csv-file-with-your-data
 # The simple format that doesn't support trades uses these fields:
@@ -166,13 +168,144 @@ def parse_receive_line(line):
     parsed_line["Comment"] = None
     return parsed_line
 
+# output files use a large write buffer to keep the number of write calls down on big exports
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# registry of export formats, keyed by the name used on the command line
+EXPORT_WRITERS = {}
+
+# class decorator to add an export format to the registry
+# checks the class is complete here so a missing piece fails at import time rather than partway through a write
+def register_writer(writer_cls):
+    for attr in ("name", "date_format", "format_row"):
+        if getattr(writer_cls, attr, None) is None:
+            raise TypeError(f"Export writer {writer_cls.__name__} must define {attr}")
+    if writer_cls.name in EXPORT_WRITERS:
+        raise TypeError(f"Export format {writer_cls.name} is already registered")
+    EXPORT_WRITERS[writer_cls.name] = writer_cls
+    return writer_cls
+
+# base class for export formats; subclasses provide the header, date format and a row conversion:
+#   format_row(self, txn, tx_date) -> list of column values, tx_date is the timestamp already formatted with date_format
+class ExportWriter:
+
+    name = None             # format name used on the command line
+    file_suffix = ""        # appended to the input file name (before the extension)
+    date_format = None      # strftime format for the transaction timestamp
+    header = []
+    notes = []              # printed after the file is saved
+
+    def __init__(self, base_fname, use_gzip):
+        self.fname = base_fname + self.file_suffix + ".csv" + (".gz" if use_gzip else "")
+        if use_gzip:
+            self._file = gzip.open(self.fname, 'wt', newline='')
+        else:
+            self._file = open(self.fname, 'w', newline='', buffering=EXPORT_BUFFER_SIZE)
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.header)
+
+    def add(self, txn, tx_date):
+        self._writer.writerow(self.format_row(txn, tx_date))
+
+    def close(self):
+        self._file.close()
+
+    # print where the file went and any notes; only called once the file has been written successfully
+    def report(self):
+        print("  Saved", self.fname)
+        for note in self.notes:
+            print(f"    ***NOTE*** -- {note}")
+
+# generic CSV with all parsed fields
+@register_writer
+class GenericCsvWriter(ExportWriter):
+
+    name = "csv"
+    date_format = "%Y-%m-%d %H:%M:%S"
+    header = ["Txn ID", "Timestamp", "Txn Type", "Amount", "Currency", "User", "Balance", "Comment", "CalculatedMintValue"]
+
+    def format_row(self, txn, tx_date):
+        return [txn["Txn ID"], tx_date, txn["Txn Type"], txn["Amount"], txn["Currency"], txn["User"], txn["Balance"],
+                txn["Comment"], txn.get("CalculatedMintValue")]
+
+# Koinly compatible file
+@register_writer
+class KoinlyWriter(ExportWriter):
+
+    name = "koinly"
+    file_suffix = "-Koinly"
+    date_format = "%Y-%m-%d %H:%M:%S"
+    header = ["Koinly Date", "Amount", "Currency", "Net Worth Amount", "Net Worth Currency", "Description"]
+
+    def format_row(self, txn, tx_date):
+        mint_value = txn.get("CalculatedMintValue")
+        koinly_amount = txn["Amount"] * (1 if txn["Txn Type"] == "RECEIVE" else -1)
+        estimated_value = koinly_amount * mint_value if mint_value else ""
+        estimated_currency = "USD" if mint_value else ""
+        return [tx_date, koinly_amount, txn["Currency"], estimated_value, estimated_currency, txn["Comment"]]
+
+# TokenTax compatible file
+# Note: since Type is mandatory the file will need to be manually edited to select
+@register_writer
+class TokenTaxWriter(ExportWriter):
+
+    name = "tokentax"
+    file_suffix = "-TokenTax"
+    date_format = "%m/%d/%Y %H:%M"
+    header = ["Type", "BuyAmount", "BuyCurrency", "SellAmount", "SellCurrency", "FeeAmount", "FeeCurrency", "Exchange", "Group", "Comment", "Date"]
+    notes = ["The 'Type' column must be manually edited to select the correct type for each transaction"]
+
+    def format_row(self, txn, tx_date):
+        if txn["Txn Type"] == "RECEIVE":
+            return ["Deposit / Income", txn["Amount"], txn["Currency"], "", "", "", "", "Neos", "", txn["Comment"], tx_date]
+        return ["Withdrawal / Spend / Gift", "", "", txn["Amount"], txn["Currency"], "", "", "Neos", "", txn["Comment"], tx_date]
+
+# TaxBit compatible file
+# Note: since "Transaction Type" is mandatory the file will need to be manually edited to select
+@register_writer
+class TaxBitWriter(ExportWriter):
+
+    name = "taxbit"
+    file_suffix = "-TaxBit"
+    date_format = "%Y-%m-%dT%H:%M:%S"
+    header = ["Date and Time", "Transaction Type", "Sent Quantity", "Sent Currency", "Sending Source",
+              "Received Quantity", "Received Currency", "Receiving Destination", "Fee", "Fee Currency",
+              "Exchange Transaction ID", "Blockchain Transaction Hash"]
+    notes = ["The 'Transaction Type' column must be manually edited to select the correct type for each transaction"]
+
+    def format_row(self, txn, tx_date):
+        if txn["Txn Type"] == "RECEIVE":
+            return [tx_date, "Transfer In / Income", "", "", "", txn["Amount"], txn["Currency"], txn["User"], "", "", "", ""]
+        return [tx_date, "Transfer Out / Expense", txn["Amount"], txn["Currency"], txn["User"], "", "", "", "", "", "", ""]
+
+# write the selected export formats in one pass over the transactions
+# each distinct date format is only run through strftime once per transaction and shared between writers
+# files are closed even if opening, writing or closing another one fails, but are only reported as saved on success
+def write_exports(neos_txns, base_fname, format_names, use_gzip):
+    writers = []
+    with ExitStack() as stack:
+        for name in dict.fromkeys(format_names):
+            writer = EXPORT_WRITERS[name](base_fname, use_gzip)
+            stack.callback(writer.close)
+            writers.append(writer)
+        date_formats = list(dict.fromkeys(writer.date_format for writer in writers))
+        for txn in neos_txns:
+            tx_dates = {fmt: txn["Timestamp"].strftime(fmt) for fmt in date_formats}
+            for writer in writers:
+                writer.add(txn, tx_dates[writer.date_format])
+    for writer in writers:
+        writer.report()
+
 def main():
 
-    if(len(sys.argv) != 2):
-        print("Usage: parse-neos-transactions [transaction_file]")
-        exit()
+    parser = argparse.ArgumentParser(prog="parse-neos-transactions", description="Convert a Neos transaction log into tax software import files")
+    parser.add_argument("transaction_file", help="Neos transaction log file")
+    parser.add_argument("-f", "--format", dest="formats", action="append", choices=list(EXPORT_WRITERS), default=None,
+                        help="export format to write; repeat to select several (default: all)")
+    parser.add_argument("-z", "--gzip", action="store_true", help="write gzip compressed output files")
+    args = parser.parse_args()
 
-    in_file_name = sys.argv[1]
+    in_file_name = args.transaction_file
     if(False == os.path.exists(in_file_name)):
         print(f"Invalid file {in_file_name}")
         exit()
@@ -224,69 +357,10 @@ def main():
         print(f"  Calculated {num_vals_found} prices based on NCR deployer transactions")
         print("  ***WARNING*** -- these prices are just an estimate any may not be a correct cost basis")
 
+    # write all selected export formats in a single pass over the transactions
     print("Saving converted files")
-    # output as generic CSV
-    out_fname_csv = os.path.splitext(in_file_name)[0] + ".csv"
-    with open(out_fname_csv, 'w', newline='') as csvfile:
-        fieldnames = ["Txn ID", "Timestamp", "Txn Type", "Amount", "Currency", "User", "Balance", "Comment", "CalculatedMintValue"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for txn in neos_txns:
-            writer.writerow(txn)
-    print("  Saved", out_fname_csv)
-
-    # Koinly compatible file
-    out_fname_koinly = os.path.splitext(in_file_name)[0] + "-Koinly.csv"
-    with open(out_fname_koinly, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["Koinly Date", "Amount", "Currency", "Net Worth Amount", "Net Worth Currency", "Description"])
-        for txn in neos_txns:
-            koinly_date = txn["Timestamp"].strftime("%Y-%m-%d %H:%M:%S")
-            koinly_amount = txn["Amount"] * (1 if txn["Txn Type"] == "RECEIVE" else -1)
-            estimated_value = koinly_amount * txn["CalculatedMintValue"] if txn["CalculatedMintValue"] else ""
-            estimated_currency = "USD" if txn["CalculatedMintValue"] else ""
-            writer.writerow([koinly_date, koinly_amount, txn["Currency"], estimated_value, estimated_currency, txn["Comment"]])
-    print("  Saved", out_fname_koinly)
-    
-    exit()
-    
-    # TokenTax compatible file
-    # Note: since Type is mandatory the file will need to be manually edited to select
-    out_fname_tokentax = os.path.splitext(in_file_name)[0] + "-TokenTax.csv"
-    with open(out_fname_tokentax, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["Type", "BuyAmount", "BuyCurrency", "SellAmount", "SellCurrency", "FeeAmount", "FeeCurrency", "Exchange", "Group", "Comment", "Date"])
-        for txn in neos_txns:
-            tx_type = "Deposit / Income" if txn["Txn Type"] == "RECEIVE" else "Withdrawal / Spend / Gift"
-            buy_amount = txn["Amount"] if txn["Txn Type"] == "RECEIVE" else ""
-            buy_currency = txn["Currency"] if txn["Txn Type"] == "RECEIVE" else ""
-            sell_amount = txn["Amount"] if txn["Txn Type"] == "SEND" else ""
-            sell_currency = txn["Currency"] if txn["Txn Type"] == "SEND" else ""
-            tx_date = txn["Timestamp"].strftime("%m/%d/%Y %H:%M")
-            writer.writerow([tx_type, buy_amount, buy_currency, sell_amount, sell_currency, "", "", "Neos", "", txn["Comment"], tx_date])
-    print("  Saved", out_fname_tokentax)
-    print("    ***NOTE*** -- The 'Type' column must be manually edited to select the correct type for each transaction")
-
-    # TaxBit compatible file
-    # Note: since "Transaction Type" is mandatory the file will need to be manually edired to select
-    out_fname_taxbit = os.path.splitext(in_file_name)[0] + "-TaxBit.csv"
-    with open(out_fname_taxbit, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["Date and Time", "Transaction Type", "Sent Quantity", "Sent Currency", "Sending Source", 
-                         "Received Quantity", "Received Currency", "Receiving Destination", "Fee", "Fee Currency", 
-                         "Exchange Transaction ID", "Blockchain Transaction Hash"])
-        for txn in neos_txns:
-            tx_date = txn["Timestamp"].strftime("%Y-%m-%dT%H:%M:%S")
-            tx_type = "Transfer In / Income" if txn["Txn Type"] == "RECEIVE" else "Transfer Out / Expense"
-            sent_qty = txn["Amount"] if txn["Txn Type"] == "SEND" else ""
-            sent_cur = txn["Currency"] if txn["Txn Type"] == "SEND" else ""
-            sending_src = txn["User"] if txn["Txn Type"] == "SEND" else ""
-            received_qty = txn["Amount"] if txn["Txn Type"] == "RECEIVE" else ""
-            received_cur = txn["Currency"] if txn["Txn Type"] == "RECEIVE" else ""
-            receiving_dest = txn["User"] if txn["Txn Type"] == "RECEIVE" else ""
-            writer.writerow([tx_date, tx_type, sent_qty, sent_cur, sending_src, received_qty, received_cur, receiving_dest, "", "", "", ""])
-    print("  Saved", out_fname_taxbit)
-    print("    ***NOTE*** -- The 'Transaction Type' column must be manually edited to select the correct type for each transaction")
+    format_names = args.formats if args.formats else list(EXPORT_WRITERS)
+    write_exports(neos_txns, os.path.splitext(in_file_name)[0], format_names, args.gzip)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file